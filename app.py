@@ -11,6 +11,9 @@ from PIL import Image
 from io import BytesIO
 from dotenv import load_dotenv
 from flask import Flask, request
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from log_config import setup_logging, update_id_var, user_id_var, product_id_var
 import asyncio
 
 load_dotenv()
@@ -22,11 +25,27 @@ MONOBANK_CARD_NUMBER = os.getenv("MONOBANK_CARD_NUMBER")
 DATABASE_URL = os.getenv("DATABASE_URL")
 RENDER_EXTERNAL_URL = os.getenv("RENDER_EXTERNAL_URL")
 
-logging.basicConfig(level=logging.INFO)
+# Масова модерація: товарів на сторінку та паузи між відправками (секунди)
+BULK_PAGE_SIZE = 10
+CHANNEL_POST_INTERVAL = 3
+NOTIFY_INTERVAL = 0.05
+
+setup_logging()
 
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(bot, storage=MemoryStorage())
 db_pool = None
+background_tasks = set()
+
+class LogContextMiddleware(BaseMiddleware):
+    # Контекст для структурованих логів: update_id і user_id поточного апдейту
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        update_id_var.set(update.update_id)
+        event = update.message or update.callback_query or update.edited_message
+        if event and event.from_user:
+            user_id_var.set(event.from_user.id)
+
+dp.middleware.setup(LogContextMiddleware())
 
 class CreateProduct(StatesGroup):
     Name = State()
@@ -65,28 +84,180 @@ async def init_db():
 
 async def save_product(data):
     async with db_pool.acquire() as conn:
-        await conn.execute("""
+        product_id = await conn.fetchval("""
             INSERT INTO products (user_id, username, name, price, photos, location, description, delivery)
             VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+            RETURNING id
         """, data['user_id'], data['username'], data['name'], data['price'], data['photos'], data['location'], data['description'], data['delivery'])
-    logging.info(f"Product '{data['name']}' saved.")
+    logging.info("Product '%s' saved.", data['name'], extra={"product_id": product_id, "sampled": True})
 
 async def update_product_status(product_id, status):
     async with db_pool.acquire() as conn:
         await conn.execute("UPDATE products SET status = $1 WHERE id = $2", status, product_id)
-    logging.info(f"Product {product_id} status updated to '{status}'.")
+    logging.info("Product status updated to '%s'.", status, extra={"product_id": product_id})
 
 async def update_channel_message_id(product_id, message_id):
     async with db_pool.acquire() as conn:
         await conn.execute("UPDATE products SET channel_message_id = $1 WHERE id = $2", message_id, product_id)
-    logging.info(f"Product {product_id} channel_message_id updated.")
+    logging.info("Product channel_message_id updated.", extra={"product_id": product_id})
 
 async def update_rotated_photos(product_id, new_file_ids):
     async with db_pool.acquire() as conn:
         await conn.execute("UPDATE products SET photos = $1 WHERE id = $2", new_file_ids, product_id)
-    logging.info(f"Product {product_id} photos updated after rotation.")
+    logging.info("Product photos updated after rotation.", extra={"product_id": product_id, "sampled": True})
+
+async def claim_pending_products(product_ids, status):
+    # Захоплюємо весь набір одним запитом: вже оброблені товари не повертаються
+    async with db_pool.acquire() as conn:
+        products = await conn.fetch(
+            "UPDATE products SET status = $1 WHERE id = ANY($2::int[]) AND status = 'pending' RETURNING *",
+            status, product_ids)
+    logging.info("Claimed %d of %d products as '%s'.", len(products), len(product_ids), status)
+    return products
+
+async def update_products_status(product_ids, status):
+    async with db_pool.acquire() as conn:
+        await conn.execute("UPDATE products SET status = $1 WHERE id = ANY($2::int[])", status, product_ids)
+    logging.info("%d products status updated to '%s'.", len(product_ids), status)
+
+async def mark_products_published(posted):
+    async with db_pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE products AS p SET channel_message_id = v.message_id, status = 'approved'
+            FROM unnest($1::int[], $2::bigint[]) AS v(id, message_id)
+            WHERE p.id = v.id
+        """, [product_id for product_id, _ in posted], [message_id for _, message_id in posted])
+    logging.info("%d products published.", len(posted))
+
+async def requeue_unpublished_products():
+    # Опубліковані товари одразу отримують 'approved', тож у 'publishing' після перезапуску
+    # лишаються лише товари, які ще не відправлялись у канал
+    async with db_pool.acquire() as conn:
+        result = await conn.execute("UPDATE products SET status = 'pending' WHERE status = 'publishing'")
+    logging.info("Requeued unpublished products: %s.", result)
+
+async def get_pending_page(page):
+    async with db_pool.acquire() as conn:
+        total = await conn.fetchval("SELECT COUNT(*) FROM products WHERE status = 'pending'")
+        products = await conn.fetch(
+            "SELECT id, user_id, username, name, price FROM products WHERE status = 'pending' ORDER BY created_at LIMIT $1 OFFSET $2",
+            BULK_PAGE_SIZE, page * BULK_PAGE_SIZE)
+    return products, total
+
+def shorten(text, limit):
+    text = str(text)
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def build_channel_caption(product):
+    return (
+        f"📦 Назва: {product['name']}\n"
+        f"💰 Ціна: {product['price']}\n"
+        f"📍 Доставка: {product['delivery']}\n"
+        f"📝 Опис: {product['description']}\n"
+        f"👤 Продавець: @{product['username']}"
+    )
+
+async def call_with_retry(method, *args, **kwargs):
+    while True:
+        try:
+            return await method(*args, **kwargs)
+        except RetryAfter as e:
+            await asyncio.sleep(e.timeout)
+
+def track_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def report_batch_failure(moderator_id, error):
+    try:
+        await bot.send_message(moderator_id, f"⚠️ Помилка масової модерації: {error}")
+    except Exception as e:
+        logging.error("Error reporting batch failure to moderator %s: %s", moderator_id, e)
+
+def run_in_background(coro, moderator_id):
+    def on_done(task):
+        if task.cancelled() or task.exception() is None:
+            return
+        logging.error("Bulk moderation batch failed: %s", task.exception())
+        track_task(report_batch_failure(moderator_id, task.exception()))
+
+    track_task(coro).add_done_callback(on_done)
+
+async def notify_sellers(notifications):
+    for i, (user_id, text) in enumerate(notifications):
+        if i:
+            await asyncio.sleep(NOTIFY_INTERVAL)
+        try:
+            await call_with_retry(bot.send_message, user_id, text)
+        except Exception as e:
+            logging.error("Error notifying seller %s: %s", user_id, e)
+
+async def publish_approved_batch(products, moderator_id):
+    published = []
+    unsaved = []
+
+    async def on_published(product):
+        published.append(product['id'])
+        await notify_sellers([(product['user_id'], f"✅ Ваш товар \"{product['name']}\" опубліковано в каналі.")])
+
+    try:
+        attempts = 0
+        for product in products:
+            media = [InputMediaPhoto(photo) for photo in product['photos'] or []]
+            if not media:
+                continue
+            if attempts:
+                await asyncio.sleep(CHANNEL_POST_INTERVAL)
+            attempts += 1
+            media[0].caption = build_channel_caption(product)
+            media[0].parse_mode = ParseMode.HTML
+            try:
+                sent_messages = await call_with_retry(bot.send_media_group, CHANNEL_ID, media)
+            except Exception as e:
+                logging.error("Error publishing product: %s", e, extra={"product_id": product['id']})
+                continue
+            # Зберігаємо одразу після відправки: опублікований товар не повинен лишатися в 'publishing'
+            posted = (product['id'], sent_messages[0].message_id)
+            try:
+                await mark_products_published([posted])
+            except Exception as e:
+                logging.error("Error saving published product (message_id %s): %s", posted[1], e, extra={"product_id": product['id']})
+                unsaved.append((product, posted))
+                continue
+            await on_published(product)
+    finally:
+        if unsaved:
+            try:
+                await mark_products_published([posted for _, posted in unsaved])
+                for product, _ in unsaved:
+                    await on_published(product)
+                unsaved.clear()
+            except Exception as e:
+                logging.error("Error saving published products: %s", e)
+        handled = set(published) | {product['id'] for product, _ in unsaved}
+        # Товари, які так і не було відправлено в канал, повертаються в чергу модерації
+        requeue = [p['id'] for p in products if p['id'] not in handled]
+        try:
+            if requeue:
+                await update_products_status(requeue, 'pending')
+        except Exception as e:
+            logging.error("Error requeueing products: %s", e)
+        summary = f"✅ Опубліковано: {len(published)}. Повернуто в чергу: {len(requeue)}."
+        if unsaved:
+            summary += f"\n⚠️ Опубліковано, але не збережено в БД (не схвалюйте повторно): {', '.join(f'#{product_id} → {message_id}' for _, (product_id, message_id) in unsaved)}."
+        await bot.send_message(moderator_id, summary)
+
+async def reject_batch(products, moderator_id):
+    await notify_sellers([
+        (p['user_id'], f"❌ Ваш товар \"{p['name']}\" відхилено модератором.")
+        for p in products
+    ])
+    await bot.send_message(moderator_id, f"❌ Відхилено: {len(products)}.")
 
 async def rotate_photos_and_notify(product):
+    product_id_var.set(product['id'])
     new_file_ids = []
     for file_id in product['photos']:
         try:
@@ -101,12 +272,12 @@ async def rotate_photos_and_notify(product):
             msg = await bot.send_photo(product['user_id'], buf, caption="🔁 Повернуте фото")
             new_file_ids.append(msg.photo[-1].file_id)
         except Exception as e:
-            logging.error(f"Error rotating photo {file_id} for product {product['id']}: {e}")
+            logging.error("Error rotating photo %s: %s", file_id, e)
             new_file_ids.append(file_id)
     await update_rotated_photos(product['id'], new_file_ids)
     await bot.send_message(product['user_id'], "🔄 Ваш товар оновлено. Фото повернуті.")
     await update_product_status(product['id'], "rotated")
-    logging.info(f"User {product['user_id']} notified about photo rotation.")
+    logging.info("User %s notified about photo rotation.", product['user_id'], extra={"sampled": True})
 
 @dp.message_handler(commands="start")
 async def cmd_start(message: types.Message):
@@ -115,6 +286,15 @@ async def cmd_start(message: types.Message):
     keyboard.add("📖 Правила")
     await message.answer("👋 Ласкаво просимо! Оберіть дію:", reply_markup=keyboard)
 
+# Зареєстровано до обробників CreateProduct, щоб команда не сприймалась як відповідь у формі
+@dp.message_handler(commands="moderate", state="*")
+async def cmd_bulk_moderation(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await state.update_data(bulk_page=0, bulk_selected=[])
+    text, kb, _, _ = await render_bulk_page(0, set())
+    await message.answer(text, reply_markup=kb)
+
 @dp.message_handler(lambda m: m.text == "📦 Додати товар")
 async def add_product(message: types.Message):
     await message.answer("✏️ Введіть назву товару:", reply_markup=types.ReplyKeyboardRemove())
@@ -224,7 +404,7 @@ async def confirm_post(message: types.Message, state: FSMContext):
         try:
             await bot.send_media_group(ADMIN_IDS[0], media_group)
         except Exception as e:
-            logging.error(f"Error sending media group to moderator: {e}")
+            logging.error("Error sending media group to moderator: %s", e)
             await bot.send_message(ADMIN_IDS[0], "Помилка при завантаженні фотографій. Перевірте вручну.")
     for admin_id in ADMIN_IDS:
         await bot.send_message(admin_id, moderator_product_info, reply_markup=moderator_keyboard)
@@ -251,15 +431,8 @@ async def moderator_action(callback: types.CallbackQuery):
 
     if action == "approve":
         media = [InputMediaPhoto(photo) for photo in product['photos']]
-        caption = (
-            f"📦 Назва: {product['name']}\n"
-            f"💰 Ціна: {product['price']}\n"
-            f"📍 Доставка: {product['delivery']}\n"
-            f"📝 Опис: {product['description']}\n"
-            f"👤 Продавець: @{product['username']}"
-        )
         if media:
-            media[0].caption = caption
+            media[0].caption = build_channel_caption(product)
             media[0].parse_mode = ParseMode.HTML
             try:
                 sent_messages = await bot.send_media_group(CHANNEL_ID, media)
@@ -285,6 +458,77 @@ async def moderator_action(callback: types.CallbackQuery):
 
     await callback.answer()
 
+async def render_bulk_page(page, selected):
+    products, total = await get_pending_page(page)
+    pages = max(1, -(-total // BULK_PAGE_SIZE))
+    if page >= pages:
+        page = pages - 1
+        products, total = await get_pending_page(page)
+
+    lines = [f"🗂 Масова модерація: {total} товарів у черзі (сторінка {page + 1}/{pages})"]
+    kb = InlineKeyboardMarkup(row_width=2)
+    for p in products:
+        # Назва, ціна й username — довільний текст продавця; обрізаємо, щоб сторінка вміщалась у 4096 символів
+        lines.append(f"#{p['id']} {shorten(p['name'], 60)} — {shorten(p['price'], 20)} (@{shorten(p['username'], 32)})")
+        mark = "☑️" if p['id'] in selected else "⬜"
+        kb.add(InlineKeyboardButton(f"{mark} #{p['id']} {shorten(p['name'], 40)}", callback_data=f"bulk:toggle:{p['id']}"))
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"bulk:page:{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"bulk:page:{page + 1}"))
+    if nav:
+        kb.row(*nav)
+    if products:
+        kb.add(InlineKeyboardButton("☑️ Вибрати всі на сторінці", callback_data="bulk:all"))
+    kb.add(
+        InlineKeyboardButton(f"✅ Опублікувати вибрані ({len(selected)})", callback_data="bulk:approve"),
+        InlineKeyboardButton(f"❌ Відхилити вибрані ({len(selected)})", callback_data="bulk:reject")
+    )
+    return "\n".join(lines), kb, page, [p['id'] for p in products]
+
+@dp.callback_query_handler(lambda c: c.data.startswith("bulk:"), state="*")
+async def bulk_moderation_action(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("Немає доступу", show_alert=True)
+        return
+
+    data = await state.get_data()
+    page = data.get("bulk_page", 0)
+    selected = set(data.get("bulk_selected", []))
+    _, action, *args = callback.data.split(":")
+    answer_text = None
+
+    if action == "toggle":
+        selected ^= {int(args[0])}
+    elif action == "page":
+        page = int(args[0])
+    elif action == "all":
+        _, _, page, page_ids = await render_bulk_page(page, selected)
+        selected.update(page_ids)
+    elif action in ("approve", "reject"):
+        if not selected:
+            await callback.answer("Нічого не вибрано.", show_alert=True)
+            return
+        # Схвалені товари отримують 'approved' лише після публікації в каналі
+        status = 'publishing' if action == "approve" else 'rejected'
+        products = await claim_pending_products(list(selected), status)
+        selected = set()
+        if action == "approve":
+            run_in_background(publish_approved_batch(products, callback.from_user.id), callback.from_user.id)
+        else:
+            run_in_background(reject_batch(products, callback.from_user.id), callback.from_user.id)
+        answer_text = f"Взято в обробку: {len(products)}."
+
+    text, kb, page, _ = await render_bulk_page(page, selected)
+    await state.update_data(bulk_page=page, bulk_selected=list(selected))
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except MessageNotModified:
+        pass
+    await callback.answer(answer_text)
+
 @dp.message_handler(lambda m: m.text == "📋 Мої товари")
 async def list_user_products(message: types.Message):
     async with db_pool.acquire() as conn:
@@ -297,14 +541,16 @@ async def list_user_products(message: types.Message):
             'pending': '⏳',
             'approved': '✅',
             'rejected': '❌',
-            'rotated': '🔄'
+            'rotated': '🔄',
+            'publishing': '📤'
         }.get(p['status'], '')
+        status_label = {'publishing': 'публікується'}.get(p['status'], p['status'])
         text = (f"{status_emoji} <b>{p['name']}</b>\n"
                 f"💰 {p['price']}\n"
                 f"📍 {p['location']}\n"
                 f"🚚 {p['delivery']}\n"
                 f"📝 {p['description']}\n"
-                f"Статус: {p['status']}")
+                f"Статус: {status_label}")
         kb = InlineKeyboardMarkup()
         if p['status'] == 'approved':
             kb.add(InlineKeyboardButton("Продано ✅", callback_data=f"sold_{p['id']}"))
@@ -363,6 +609,7 @@ async def show_rules(message: types.Message):
 
 async def on_startup(dp):
     await init_db()
+    await requeue_unpublished_products()
     logging.info("Бот запущено.")
 
 # Flask + webhook
@@ -0,0 +1,58 @@
+import io
+import logging
+import os
+import sys
+import time
+import timeit
+
+from log_config import setup_logging, stop_logging, update_id_var, user_id_var
+
+# Мікробенчмарк: накладні витрати логування на один апдейт у потоці event loop.
+# Один "апдейт" — типовий набір записів модерації: збереження, статус, channel_message_id.
+# Запуск: python bench_logging.py [кількість апдейтів]
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+
+# Імітація stdout, що блокує (pipe до збирача логів): ~100 мкс на запис
+class BlockingStream(io.TextIOBase):
+    def write(self, s):
+        time.sleep(0.0001)
+        return len(s)
+
+
+def per_update_fstring(i):
+    update_id_var.set(i)
+    user_id_var.set(i % 100)
+    logging.info(f"Product 'item {i}' saved.")
+    logging.info(f"Product {i} status updated to 'approved'.")
+    logging.info(f"Product {i} channel_message_id updated.")
+
+
+def per_update_queue(i):
+    update_id_var.set(i)
+    user_id_var.set(i % 100)
+    logging.info("Product '%s' saved.", i, extra={"product_id": i, "sampled": True})
+    logging.info("Product status updated to '%s'.", "approved", extra={"product_id": i})
+    logging.info("Product channel_message_id updated.", extra={"product_id": i})
+
+
+def run(label, func):
+    seconds = timeit.timeit(lambda: [func(i) for i in range(UPDATES)], number=1)
+    print(f"{label:<48} {seconds / UPDATES * 1e6:8.2f} µs/update")
+
+
+if __name__ == "__main__":
+    devnull = open(os.devnull, "w")
+    for sink_name, sink in (("devnull", devnull), ("blocking", BlockingStream())):
+        logging.basicConfig(level=logging.INFO, stream=sink, force=True)
+        run(f"[{sink_name}] basicConfig, f-string", per_update_fstring)
+        logging.getLogger().setLevel(logging.WARNING)
+        run(f"[{sink_name}] basicConfig, f-string, INFO filtered", per_update_fstring)
+
+        setup_logging(level="INFO", sample_rate=10, stream=sink)
+        run(f"[{sink_name}] queue + %-args + sampling", per_update_queue)
+        logging.getLogger().setLevel(logging.WARNING)
+        run(f"[{sink_name}] queue + %-args, INFO filtered", per_update_queue)
+        stop_logging()
+    devnull.close()
@@ -0,0 +1,90 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from collections import defaultdict
+
+# Контекст поточного апдейту; заповнюється middleware в app.py і копіюється в дочірні задачі
+update_id_var = contextvars.ContextVar("update_id", default="-")
+user_id_var = contextvars.ContextVar("user_id", default="-")
+product_id_var = contextvars.ContextVar("product_id", default="-")
+
+CONTEXT_FIELDS = (
+    ("update_id", update_id_var),
+    ("user_id", user_id_var),
+    ("product_id", product_id_var),
+)
+
+LOG_FORMAT = (
+    "%(asctime)s level=%(levelname)s logger=%(name)s "
+    "update_id=%(update_id)s user_id=%(user_id)s product_id=%(product_id)s "
+    "msg=\"%(message)s\""
+)
+
+
+# Додає до запису update_id, user_id і product_id, якщо їх не передано через extra
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        for name, var in CONTEXT_FIELDS:
+            if not hasattr(record, name):
+                setattr(record, name, var.get())
+        return True
+
+
+# Пропускає кожен N-й info-запис, позначений extra={"sampled": True}; решту записів не чіпає
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(1, rate)
+        self.counters = defaultdict(int)
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not getattr(record, "sampled", False):
+            return True
+        count = self.counters[record.msg]
+        self.counters[record.msg] = count + 1
+        return count % self.rate == 0
+
+
+_listener = None
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# Налаштовує кореневий логер замість logging.basicConfig; запис у stdout іде з окремого потоку
+def setup_logging(level=None, sample_rate=None, stream=None):
+    global _listener
+    stop_logging()
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    if not isinstance(logging.getLevelName(level), int):
+        level = "INFO"
+    sample_rate = sample_rate or int(os.getenv("LOG_SAMPLE_RATE", "10"))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rate))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+atexit.register(stop_logging)